@@ -0,0 +1,426 @@
+"""Run the CDN services in one process against local stand-ins and benchmark them.
+
+Redis is replaced by an in-memory dict, MinIO by FilesystemStorage in a
+temporary directory and PostgreSQL by in-memory SQLite.  Services talk to each
+other through in-process ASGI transports, so results measure the services'
+own code paths rather than the network.
+
+    python benchmark/run.py --files 2000 --requests 20000 --concurrency 32
+"""
+import argparse
+import asyncio
+import bisect
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from standins import (
+    FilesystemMinio, InMemoryRedis, ServiceRouter, sqlite_database_class
+)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Each service is a flat directory whose modules share names (app, models, ...),
+# so they are imported one at a time and evicted from sys.modules in between.
+SERVICE_MODULES = ('app', 'models', 'metrics', 'admission', 'cache', 'database', 'storage')
+
+META_ADDRESS = 'localhost:8002'
+ORIGIN_ADDRESS = 'localhost:8001'
+CDN_ADDRESS = 'localhost:4000'
+FSS_ADDRESS = 'localhost:5050'
+
+# The client sits next to the CDN node, so the meta server prefers it over FSS.
+CLIENT_LAT = 37.7749
+CLIENT_LNG = -122.4194
+
+
+def load_service(directory: str, patch_before_app=None):
+    for name in SERVICE_MODULES:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, str(REPO_ROOT / directory))
+    try:
+        if patch_before_app is not None:
+            patch_before_app()
+        return importlib.import_module('app')
+    finally:
+        sys.path.pop(0)
+        for name in SERVICE_MODULES:
+            sys.modules.pop(name, None)
+
+
+class Cluster:
+    def __init__(self, storage_root: str, local_cache: str = 'memory', local_cache_path: str = None,
+                 redis_size: int = 0):
+        os.environ.update({
+            'META_SERVER_URL': f'http://{META_ADDRESS}',
+            'FSS_URL': f'http://{FSS_ADDRESS}',
+            'STORAGE_BACKEND': 'filesystem',
+            'STORAGE_ROOT': storage_root,
+            'LOCAL_CACHE_BACKEND': local_cache,
+        })
+        if local_cache_path is not None:
+            os.environ['LOCAL_CACHE_PATH'] = local_cache_path
+
+        self.router = ServiceRouter()
+        router = self.router
+
+        class RoutedAsyncClient(httpx.AsyncClient):
+            def __init__(self, *args, **kwargs):
+                kwargs.setdefault('transport', router)
+                super().__init__(*args, **kwargs)
+
+        httpx.AsyncClient = RoutedAsyncClient
+
+        def use_sqlite():
+            database = importlib.import_module('database')
+            database.Database = sqlite_database_class(database.Database)
+
+        self.meta = load_service('meta-server', use_sqlite)
+        self.origin = load_service('origin-server')
+        self.fss = load_service('fss')
+        self.cdn = load_service('cdn-node')
+
+        self.redis = InMemoryRedis(max_bytes=redis_size)
+        self.cdn.redis_client = self.redis
+        self.cdn.minio_client = FilesystemMinio(self.fss.storage)
+
+        router.mount(META_ADDRESS, self.meta.app)
+        router.mount(ORIGIN_ADDRESS, self.origin.app)
+        router.mount(FSS_ADDRESS, self.fss.app)
+        router.mount(CDN_ADDRESS, self.cdn.app)
+
+    async def register_cdn(self, client: httpx.AsyncClient):
+        response = await client.post(f'http://{META_ADDRESS}/meta/register', json={
+            'Type': 0, 'IP': CDN_ADDRESS, 'Lat': CLIENT_LAT, 'Lng': CLIENT_LNG
+        })
+        response.raise_for_status()
+        self.cdn.CDN_ID = response.json()['cdn_id']
+
+    def seed(self, files: Dict[str, str]):
+        """Store files in FSS and map them to the CDN node, as after earlier traffic."""
+        for name, content in files.items():
+            self.fss.storage.put_file(name, content.encode('utf-8'))
+            self.meta.db.add_or_update_file(name, '', 0)
+            self.meta.db.add_cdn_file_mapping(name, self.cdn.CDN_ID)
+
+    def flush_caches(self):
+        self.redis.flushdb()
+        self.cdn.local_cache.clear()
+
+    def cdn_stats(self) -> dict:
+        return dict(self.cdn.stats)
+
+
+def parse_size(spec: str) -> int:
+    """Parse a byte count such as ``4096``, ``512kb`` or ``8mb``."""
+    spec = spec.strip().lower()
+    for suffix, factor in (('gb', 1 << 30), ('mb', 1 << 20), ('kb', 1 << 10), ('b', 1)):
+        if spec.endswith(suffix):
+            return int(float(spec[:-len(suffix)]) * factor)
+    return int(spec)
+
+
+def parse_size_mix(spec: str) -> List[Tuple[int, float]]:
+    mix = []
+    for part in spec.split(','):
+        size, weight = part.split(':')
+        mix.append((int(size), float(weight)))
+    return mix
+
+
+def make_files(count: int, size_mix: List[Tuple[int, float]], rng: random.Random,
+               prefix: str = 'bench') -> Dict[str, str]:
+    sizes = [size for size, _ in size_mix]
+    weights = [weight for _, weight in size_mix]
+    files = {}
+    for i in range(count):
+        name = f'{prefix}/{i // 100:04d}/file-{i:06d}.txt'
+        size = rng.choices(sizes, weights)[0]
+        line = f'{name} {rng.getrandbits(64):016x}\n'
+        files[name] = (line * (size // len(line) + 1))[:size]
+    return files
+
+
+class ZipfSampler:
+    def __init__(self, items: List[str], exponent: float, rng: random.Random):
+        self.items = items
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for rank in range(1, len(items) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def sample(self) -> str:
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_left(self.cumulative, point)]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def resolve(client: httpx.AsyncClient, name: str) -> Tuple[str, int]:
+    response = await client.post(f'http://{ORIGIN_ADDRESS}/origin/explicit', json={
+        'Type': 1,
+        'FileList': [{'Name': name, 'Hash': '', 'TimeStamp': '0'}],
+        'IP': '127.0.0.1',
+        'Lat': CLIENT_LAT,
+        'Lng': CLIENT_LNG
+    })
+    response.raise_for_status()
+    data = response.json()
+    return data['cdn_address'], data['cdn_id']
+
+
+async def read_file(client: httpx.AsyncClient, name: str) -> int:
+    address, cdn_id = await resolve(client, name)
+    if cdn_id == -1:
+        url = f'http://{address}/get/{name}'
+    else:
+        url = f'http://{address}/cdn/cache/{name}'
+    response = await client.get(url)
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def upload_file(client: httpx.AsyncClient, name: str, content: str,
+                      address: str, cdn_id: int):
+    if cdn_id == -1:
+        response = await client.post(
+            f'http://{address}/post/{name}', content=content,
+            headers={'Content-Type': 'text/plain'}
+        )
+    else:
+        response = await client.put(f'http://{address}/cdn/cache/{name}', json={
+            'content': content, 'file_hash': '', 'timestamp': str(int(time.time()))
+        })
+    response.raise_for_status()
+
+
+async def read_batch(client: httpx.AsyncClient, names: List[str]) -> int:
+    response = await client.post(f'http://{CDN_ADDRESS}/cdn/batch', json={'paths': names})
+    response.raise_for_status()
+    return len(response.content)
+
+
+async def write_file(client: httpx.AsyncClient, name: str, content: str):
+    address, cdn_id = await resolve(client, name)
+    await upload_file(client, name, content, address, cdn_id)
+
+
+async def run_ops(ops, concurrency: int) -> Tuple[List[float], float, int]:
+    """Run (coroutine factory) ops with bounded concurrency; return latencies, wall time, errors."""
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for op in ops:
+        queue.put_nowait(op)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                op = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                await op()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - start, errors
+
+
+def summarize(name: str, latencies: List[float], elapsed: float, errors: int,
+              before: Optional[dict] = None, after: Optional[dict] = None,
+              objects_per_op: int = 1) -> dict:
+    """Latencies are per op; ``objects`` and ``objects_per_s`` count files moved."""
+    latencies = sorted(latencies)
+    result = {
+        'scenario': name,
+        'ops': len(latencies),
+        'objects_per_op': objects_per_op,
+        'objects': len(latencies) * objects_per_op,
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'objects_per_s': len(latencies) * objects_per_op / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+    if before is not None and after is not None:
+        delta = {key: after[key] - before[key] for key in after}
+        requests = delta['requests'] or 1
+        served_bytes = delta['redis_hit_bytes'] + delta['local_hit_bytes'] + delta['fss_hit_bytes']
+        result.update({
+            'redis_hit_ratio': delta['redis_hits'] / requests,
+            'local_hit_ratio': delta['local_hits'] / requests,
+            'fss_ratio': delta['fss_hits'] / requests,
+            'byte_hit_ratio': (
+                (delta['redis_hit_bytes'] + delta['local_hit_bytes']) / served_bytes
+                if served_bytes else 0.0
+            ),
+        })
+    return result
+
+
+async def scenario_reads(cluster: Cluster, client: httpx.AsyncClient, name: str,
+                         sampler: ZipfSampler, requests: int, concurrency: int) -> dict:
+    names = [sampler.sample() for _ in range(requests)]
+    ops = [lambda n=n: read_file(client, n) for n in names]
+    before = cluster.cdn_stats()
+    latencies, elapsed, errors = await run_ops(ops, concurrency)
+    return summarize(name, latencies, elapsed, errors, before, cluster.cdn_stats())
+
+
+async def scenario_batch(cluster: Cluster, client: httpx.AsyncClient, sampler: ZipfSampler,
+                         requests: int, batch_size: int, concurrency: int) -> dict:
+    batches = [[sampler.sample() for _ in range(batch_size)]
+               for _ in range(max(1, requests // batch_size))]
+    ops = [lambda b=b: read_batch(client, b) for b in batches]
+    before = cluster.cdn_stats()
+    latencies, elapsed, errors = await run_ops(ops, concurrency)
+    return summarize('batch', latencies, elapsed, errors, before, cluster.cdn_stats(),
+                     objects_per_op=batch_size)
+
+
+async def scenario_sync(client: httpx.AsyncClient, files: Dict[str, str], concurrency: int) -> dict:
+    start = time.perf_counter()
+    response = await client.post(f'http://{ORIGIN_ADDRESS}/origin/sync', json={
+        'Type': 0,
+        'FileList': [{'Name': name, 'Hash': '', 'TimeStamp': '0'} for name in files],
+        'IP': '127.0.0.1',
+        'Lat': CLIENT_LAT,
+        'Lng': CLIENT_LNG
+    })
+    response.raise_for_status()
+    resolve_time = time.perf_counter() - start
+
+    ops = [
+        lambda f=f: upload_file(client, f['file_name'], files[f['file_name']],
+                                f['cdn_address'], f['cdn_id'])
+        for f in response.json()['files']
+    ]
+    latencies, elapsed, errors = await run_ops(ops, concurrency)
+    result = summarize('sync', latencies, elapsed + resolve_time, errors)
+    result['resolve_ms'] = resolve_time * 1000
+    return result
+
+
+async def scenario_mixed(cluster: Cluster, client: httpx.AsyncClient, sampler: ZipfSampler,
+                         files: Dict[str, str], requests: int, write_ratio: float,
+                         concurrency: int, rng: random.Random) -> dict:
+    ops = []
+    for _ in range(requests):
+        name = sampler.sample()
+        if rng.random() < write_ratio:
+            ops.append(lambda n=name: write_file(client, n, files[n]))
+        else:
+            ops.append(lambda n=name: read_file(client, n))
+    before = cluster.cdn_stats()
+    latencies, elapsed, errors = await run_ops(ops, concurrency)
+    return summarize('mixed', latencies, elapsed, errors, before, cluster.cdn_stats())
+
+
+def print_report(results: List[dict], local_cache: str, redis_size: int, redis_evictions: int):
+    budget = f"{redis_size / (1 << 20):.1f}MB" if redis_size else "unbounded"
+    print(f"local cache backend: {local_cache}, redis: {budget}, {redis_evictions} evictions")
+    header = f"{'scenario':<10}{'ops':>8}{'err':>6}{'ops/s':>10}{'obj/s':>10}{'p50 ms':>10}{'p99 ms':>10}" \
+             f"{'redis':>8}{'local':>8}{'fss':>8}{'byte hit':>10}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        ratios = ''
+        if 'redis_hit_ratio' in r:
+            ratios = f"{r['redis_hit_ratio']:>8.1%}{r['local_hit_ratio']:>8.1%}" \
+                     f"{r['fss_ratio']:>8.1%}{r['byte_hit_ratio']:>10.1%}"
+        print(f"{r['scenario']:<10}{r['ops']:>8}{r['errors']:>6}{r['throughput']:>10.1f}"
+              f"{r['objects_per_s']:>10.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{ratios}")
+    for r in results:
+        if r['objects_per_op'] > 1:
+            print(f"{r['scenario']}: one op is a call fetching {r['objects_per_op']} objects; "
+                  f"ops/s and p50/p99 are per call, obj/s per object")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='CDN benchmark with local stand-ins')
+    parser.add_argument('--files', type=int, default=1000, help='Files seeded into storage')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per read scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client operations')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for file popularity')
+    parser.add_argument('--size-mix', default='1024:70,16384:25,262144:5',
+                        help='Comma-separated size:weight pairs for generated files')
+    parser.add_argument('--sync-files', type=int, default=2000, help='Files in the synced tree')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='Share of writes in the mixed scenario')
+    parser.add_argument('--batch-size', type=int, default=20, help='Paths per /cdn/batch call in the batch scenario')
+    parser.add_argument('--scenarios', default='cold,warm,sync,mixed',
+                        help='Scenarios to run, in order (cold, warm, batch, sync, mixed)')
+    parser.add_argument('--local-cache', choices=('memory', 'shared'), default='memory',
+                        help='CDN node LOCAL_CACHE_BACKEND: per-process LRU or the shared-memory arena')
+    parser.add_argument('--redis-size', type=parse_size, default='8mb',
+                        help='Redis stand-in budget with allkeys-lru eviction, e.g. 8mb (0 disables eviction)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducible workloads')
+    parser.add_argument('--json', help='Also write results to this JSON file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    size_mix = parse_size_mix(args.size_mix)
+
+    with tempfile.TemporaryDirectory(prefix='cdn-bench-') as storage_root, \
+            tempfile.TemporaryDirectory(prefix='cdn-bench-arena-') as arena_dir:
+        cluster = Cluster(storage_root, args.local_cache, os.path.join(arena_dir, 'local-cache'),
+                          args.redis_size)
+        files = make_files(args.files, size_mix, rng)
+        names = list(files)
+        rng.shuffle(names)
+        sampler = ZipfSampler(names, args.zipf, rng)
+
+        results = []
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            await cluster.register_cdn(client)
+            cluster.seed(files)
+
+            for scenario in args.scenarios.split(','):
+                if scenario == 'cold':
+                    cluster.flush_caches()
+                    results.append(await scenario_reads(
+                        cluster, client, 'cold', sampler, args.requests, args.concurrency))
+                elif scenario == 'warm':
+                    results.append(await scenario_reads(
+                        cluster, client, 'warm', sampler, args.requests, args.concurrency))
+                elif scenario == 'batch':
+                    results.append(await scenario_batch(
+                        cluster, client, sampler, args.requests, args.batch_size, args.concurrency))
+                elif scenario == 'sync':
+                    tree = make_files(args.sync_files, size_mix, rng, prefix=f'sync-{args.seed}')
+                    results.append(await scenario_sync(client, tree, args.concurrency))
+                elif scenario == 'mixed':
+                    results.append(await scenario_mixed(
+                        cluster, client, sampler, files, args.requests,
+                        args.write_ratio, args.concurrency, rng))
+                else:
+                    parser.error(f'Unknown scenario: {scenario}')
+
+    print_report(results, args.local_cache, args.redis_size, cluster.redis.evictions)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+import io
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / 'database' / 'schema.sql'
+
+
+class InMemoryRedis:
+    """The subset of the redis-py client the services use, kept in a dict.
+
+    With ``max_bytes`` set it evicts least recently used keys once values
+    exceed the budget, like ``--maxmemory ... --maxmemory-policy allkeys-lru``.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.data: Dict[str, Tuple[bytes, Optional[float]]] = OrderedDict()
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def _remove(self, key: str) -> bool:
+        entry = self.data.pop(key, None)
+        if entry is None:
+            return False
+        self.used_bytes -= len(entry[0])
+        return True
+
+    def _store(self, key: str, value, expires_at: Optional[float]):
+        self._remove(key)
+        value = self._encode(value)
+        self.data[key] = (value, expires_at)
+        self.used_bytes += len(value)
+        while self.max_bytes and self.used_bytes > self.max_bytes and len(self.data) > 1:
+            oldest = next(iter(self.data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            return self._live(key)
+
+    def mget(self, keys, *args):
+        if isinstance(keys, str):
+            keys = [keys, *args]
+        with self.lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, key: str, value, ex: Optional[int] = None):
+        expires_at = time.monotonic() + ex if ex else None
+        with self.lock:
+            self._store(key, value, expires_at)
+        return True
+
+    def mset(self, mapping: Dict[str, bytes]):
+        with self.lock:
+            for key, value in mapping.items():
+                self._store(key, value, None)
+        return True
+
+    def delete(self, *keys) -> int:
+        with self.lock:
+            return sum(1 for key in keys if self._remove(key))
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+            self.used_bytes = 0
+
+
+class FilesystemMinio:
+    """The subset of the Minio client the CDN node uses, backed by FilesystemStorage."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        return True
+
+    def make_bucket(self, bucket_name: str):
+        pass
+
+    def put_object(self, bucket_name: str, object_name: str, data: io.BytesIO, length: int):
+        self.storage.put_file(object_name, data.read(length))
+
+    def remove_object(self, bucket_name: str, object_name: str):
+        self.storage.delete_file(object_name)
+
+
+class _SQLiteCursor:
+    """Runs psycopg2-style statements on SQLite and returns rows as dicts.
+
+    Statements go through the meta-server's ``timed_statement`` like
+    ``TimedCursor``, so benchmark runs exercise the db_* metrics.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock, timed_statement):
+        self.connection = connection
+        self.lock = lock
+        self.timed_statement = timed_statement
+        self.rows = []
+
+    def execute(self, query: str, vars=None):
+        with self.timed_statement(query, self.lock):
+            cursor = self.connection.execute(query.replace('%s', '?'), vars or ())
+            self.rows = [dict(row) for row in cursor.fetchall()]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size: int):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        self.rows = []
+
+
+def sqlite_schema() -> str:
+    schema = SCHEMA_PATH.read_text()
+    schema = schema.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+    return re.sub(r'DEFAULT NOW\(\)', 'DEFAULT CURRENT_TIMESTAMP', schema)
+
+
+def sqlite_database_class(database_cls):
+    """Subclass the meta-server ``Database`` so it runs on in-memory SQLite."""
+    timed_statement = sys.modules[database_cls.__module__].timed_statement
+
+    class SQLiteDatabase(database_cls):
+        def connect(self):
+            self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.isolation_level = None
+            self.connection.execute('PRAGMA foreign_keys = ON')
+            self.connection.execute('PRAGMA case_sensitive_like = ON')
+            # PostgreSQL's "C" collation compares bytes, i.e. code points for UTF-8.
+            self.connection.create_collation('C', lambda a, b: (a > b) - (a < b))
+            self.connection.executescript(sqlite_schema())
+            self.lock = threading.Lock()
+
+        def get_cursor(self):
+            return _SQLiteCursor(self.connection, self.lock, timed_statement)
+
+    return SQLiteDatabase
+
+
+class ServiceRouter(httpx.AsyncBaseTransport):
+    """Dispatches requests to in-process ASGI apps by ``host:port``."""
+
+    def __init__(self):
+        self.transports: Dict[str, httpx.ASGITransport] = {}
+
+    def mount(self, address: str, app):
+        # Like a real server, answer 500 instead of raising app errors into the caller.
+        self.transports[address] = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        address = f"{request.url.host}:{request.url.port}"
+        transport = self.transports.get(address)
+        if transport is None:
+            raise httpx.ConnectError(f"No service mounted at {address}", request=request)
+        return await transport.handle_async_request(request)
@@ -1,14 +1,22 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 import redis
 from minio import Minio
 import httpx
+import asyncio
+import json
 import os
 import io
-from cache import LRUCache
-from models import FilePutRequest
+import hashlib
+from cache import create_local_cache
+from models import FilePutRequest, BatchGetRequest
+from admission import AdmissionMetrics, Overloaded, limiter_from_env
+from metrics import install_metrics, register_collector, registry, timed, upstream_timer
+from prometheus_client import Counter
+from prometheus_client.core import GaugeMetricFamily
 
 app = FastAPI()
+install_metrics(app)
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
@@ -18,6 +26,11 @@ MINIO_SECRET_KEY = os.getenv('MINIO_SECRET_KEY', 'minioadmin')
 META_SERVER_URL = os.getenv('META_SERVER_URL', 'http://meta-server:8002')
 FSS_URL = os.getenv('FSS_URL', 'http://fss:5000')
 CDN_ID = int(os.getenv('CDN_ID', 1))
+LOCAL_CACHE_BACKEND = os.getenv('LOCAL_CACHE_BACKEND', 'memory')
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', 10 * 1024 * 1024))
+LOCAL_CACHE_PATH = os.getenv('LOCAL_CACHE_PATH', '/dev/shm/cdn-local-cache')
+LOCAL_CACHE_MAX_ITEM_SIZE = int(os.getenv('LOCAL_CACHE_MAX_ITEM_SIZE', 64 * 1024))
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', 30))
 
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
 minio_client = Minio(
@@ -26,9 +39,93 @@ minio_client = Minio(
     secret_key=MINIO_SECRET_KEY,
     secure=False
 )
-local_cache = LRUCache(max_size=10 * 1024 * 1024)
+local_cache = create_local_cache(
+    LOCAL_CACHE_BACKEND,
+    max_size=LOCAL_CACHE_SIZE,
+    path=LOCAL_CACHE_PATH,
+    max_item_size=LOCAL_CACHE_MAX_ITEM_SIZE
+)
 
 BUCKET_NAME = 'cdn-files'
+BUNDLE_MEDIA_TYPE = 'application/x-cdn-bundle'
+
+admission_metrics = AdmissionMetrics(registry)
+fss_limiter = limiter_from_env('fss', 'FSS', admission_metrics)
+meta_limiter = limiter_from_env('meta', 'META', admission_metrics)
+
+# Every path in a batch may miss, so one batch is capped at the number of FSS
+# calls the limiter is sized to hold (running plus queued).
+BATCH_LIMIT = fss_limiter.max_concurrency + fss_limiter.max_queue
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', BATCH_LIMIT))
+if MAX_BATCH_SIZE > BATCH_LIMIT:
+    print(f"MAX_BATCH_SIZE={MAX_BATCH_SIZE} exceeds the FSS admission limit, using {BATCH_LIMIT}")
+    MAX_BATCH_SIZE = BATCH_LIMIT
+
+stats = {
+    "requests": 0,
+    "redis_hits": 0,
+    "local_hits": 0,
+    "fss_hits": 0,
+    "negative_hits": 0,
+    "not_found": 0,
+    "upstream_errors": 0,
+    "redis_hit_bytes": 0,
+    "local_hit_bytes": 0,
+    "fss_hit_bytes": 0
+}
+
+CACHE_REQUESTS = Counter("cdn_cache_requests", "File requests served by this node", registry=registry)
+CACHE_HITS = Counter("cdn_cache_hits", "Requests answered by each tier", ["tier"], registry=registry)
+CACHE_HIT_BYTES = Counter("cdn_cache_hit_bytes", "Bytes answered by each tier", ["tier"], registry=registry)
+NOT_FOUND = Counter("cdn_not_found", "Requests answered with 404", registry=registry)
+UPSTREAM_ERRORS = Counter("cdn_upstream_errors", "Failed or unexpected FSS responses", registry=registry)
+
+# ``stats`` is this worker's view for /cdn/stats; the Prometheus counters add
+# up across workers when PROMETHEUS_MULTIPROC_DIR is set.
+STAT_COUNTERS = {
+    "requests": CACHE_REQUESTS,
+    "negative_hits": CACHE_HITS.labels("negative"),
+    "not_found": NOT_FOUND,
+    "upstream_errors": UPSTREAM_ERRORS,
+}
+for tier in ("redis", "local", "fss"):
+    STAT_COUNTERS[f"{tier}_hits"] = CACHE_HITS.labels(tier)
+    STAT_COUNTERS[f"{tier}_hit_bytes"] = CACHE_HIT_BYTES.labels(tier)
+
+def count(stat: str, amount: int = 1):
+    stats[stat] += amount
+    STAT_COUNTERS[stat].inc(amount)
+
+class LocalCacheCollector:
+    """Exports local cache occupancy at scrape time.
+
+    The shared backend reports the whole node; the memory backend reports the
+    worker answering the scrape.
+    """
+
+    def collect(self):
+        local_bytes = GaugeMetricFamily("cdn_local_cache_bytes", "Bytes held in the local cache")
+        local_bytes.add_metric([], local_cache.current_size)
+        local_capacity = GaugeMetricFamily("cdn_local_cache_capacity_bytes", "Local cache capacity")
+        local_capacity.add_metric([], local_cache.max_size)
+        return [local_bytes, local_capacity]
+
+register_collector(LocalCacheCollector())
+
+def negative_redis_key(file_path: str) -> str:
+    return f"cdn-neg:{file_path}"
+
+def remember_not_found(file_path: str):
+    if NEGATIVE_CACHE_TTL <= 0:
+        return
+    redis_client.set(negative_redis_key(file_path), b"1", ex=NEGATIVE_CACHE_TTL)
+
+def forget_not_found(file_path: str):
+    redis_client.delete(negative_redis_key(file_path))
+
+def not_found(file_path: str):
+    count("not_found")
+    return HTTPException(status_code=404, detail="File not found")
 
 @app.on_event("startup")
 async def startup_event():
@@ -55,79 +152,209 @@ async def startup_event():
         print(f"Error registering CDN: {str(e)}")
 
 
+async def fill_from_fss(client: httpx.AsyncClient, file_path: str) -> bytes:
+    """Fetch a cache miss from FSS, populate both cache tiers and record the mapping."""
+    try:
+        async with fss_limiter.slot():
+            with upstream_timer('fss', 'get'):
+                response = await client.get(f"{FSS_URL}/get/{file_path}")
+    except httpx.HTTPError as e:
+        count("upstream_errors")
+        raise HTTPException(status_code=502, detail=f"FSS error: {str(e)}")
+    
+    if response.status_code == 404:
+        remember_not_found(file_path)
+        raise not_found(file_path)
+    if response.status_code != 200:
+        count("upstream_errors")
+        raise HTTPException(status_code=502, detail=f"FSS returned {response.status_code}")
+    
+    count("fss_hits")
+    content = response.text
+    content_bytes = content.encode('utf-8')
+    count("fss_hit_bytes", len(content_bytes))
+    
+    with upstream_timer('redis', 'set'):
+        redis_client.set(f"cdn:{file_path}", content_bytes)
+    local_cache.put(file_path, content_bytes)
+    
+    try:
+        async with meta_limiter.slot():
+            with upstream_timer('meta', 'update'):
+                await client.post(
+                    f"{META_SERVER_URL}/meta/update",
+                    json={
+                        "file_name": file_path,
+                        "file_hash": hashlib.md5(content_bytes).hexdigest(),
+                        "timestamp": "0",
+                        "cdn_id": CDN_ID
+                    }
+                )
+    except (httpx.HTTPError, Overloaded) as e:
+        print(f"Error updating metadata for {file_path}: {str(e)}")
+    
+    return content_bytes
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/cdn/stats")
+def get_stats():
+    return {
+        **stats,
+        "admission": {
+            "fss": fss_limiter.snapshot(),
+            "meta": meta_limiter.snapshot()
+        }
+    }
+
 @app.get("/cdn/cache/{file_path:path}", response_class=PlainTextResponse)
 async def get_file(file_path: str):
     cache_key = f"cdn:{file_path}"
+    count("requests")
     
-    cached_content = redis_client.get(cache_key)
+    with upstream_timer('redis', 'mget'):
+        cached_content, negative_entry = redis_client.mget(cache_key, negative_redis_key(file_path))
     if cached_content:
+        count("redis_hits")
+        count("redis_hit_bytes", len(cached_content))
         return cached_content.decode('utf-8')
     
-    local_content = local_cache.get(file_path)
+    with timed('local'):
+        local_content = local_cache.get(file_path)
     if local_content:
-        redis_client.set(cache_key, local_content)
+        count("local_hits")
+        count("local_hit_bytes", len(local_content))
+        with upstream_timer('redis', 'set'):
+            redis_client.set(cache_key, local_content)
         return local_content.decode('utf-8')
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{FSS_URL}/get/{file_path}")
-            if response.status_code == 200:
-                content = response.text
-                content_bytes = content.encode('utf-8')
-                
-                redis_client.set(cache_key, content_bytes)
-                local_cache.put(file_path, content_bytes)
-                
-                async with httpx.AsyncClient() as meta_client:
-                    await meta_client.post(
-                        f"{META_SERVER_URL}/meta/update",
-                        json={
-                            "file_name": file_path,
-                            "file_hash": "",
-                            "timestamp": "0",
-                            "cdn_id": CDN_ID
-                        }
-                    )
-                
-                return content
-            else:
-                raise HTTPException(status_code=404, detail="File not found")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if negative_entry:
+        count("negative_hits")
+        raise not_found(file_path)
+    
+    async with httpx.AsyncClient() as client:
+        content_bytes = await fill_from_fss(client, file_path)
+    return content_bytes.decode('utf-8')
+
+def encode_bundle_entry(file_path: str, status: int, content: bytes) -> bytes:
+    # Each entry is a JSON header line followed by exactly `length` raw bytes.
+    header = json.dumps({"path": file_path, "status": status, "length": len(content)})
+    return header.encode('utf-8') + b"\n" + content
+
+@app.post("/cdn/batch")
+async def get_files_batch(request: BatchGetRequest):
+    paths = list(dict.fromkeys(request.paths))
+    if len(paths) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} paths per batch")
+    count("requests", len(paths))
+    
+    keys = [f"cdn:{path}" for path in paths] + [negative_redis_key(path) for path in paths]
+    with upstream_timer('redis', 'mget'):
+        values = redis_client.mget(keys)
+    
+    ready = []
+    backfill = {}
+    misses = []
+    for path, cached_content, negative_entry in zip(paths, values[:len(paths)], values[len(paths):]):
+        if cached_content:
+            count("redis_hits")
+            count("redis_hit_bytes", len(cached_content))
+            ready.append((path, 200, cached_content))
+            continue
+        
+        local_content = local_cache.get(path)
+        if local_content:
+            count("local_hits")
+            count("local_hit_bytes", len(local_content))
+            backfill[f"cdn:{path}"] = local_content
+            ready.append((path, 200, local_content))
+            continue
+        
+        if negative_entry:
+            count("negative_hits")
+            count("not_found")
+            ready.append((path, 404, b""))
+            continue
+        
+        misses.append(path)
+    
+    if backfill:
+        with upstream_timer('redis', 'mset'):
+            redis_client.mset(backfill)
+    
+    # Misses are filled at most as many at a time as the FSS limiter runs, so a
+    # cold batch waits its turn here instead of overflowing the limiter's queue.
+    fanout = asyncio.Semaphore(fss_limiter.max_concurrency)
+    
+    async def fill(client: httpx.AsyncClient, path: str):
+        try:
+            async with fanout:
+                return path, 200, await fill_from_fss(client, path)
+        except HTTPException as e:
+            return path, e.status_code, b""
+        except Overloaded:
+            return path, 503, b""
+        except Exception:
+            # Headers are already sent, so every failure must become an entry.
+            return path, 502, b""
+    
+    async def bundle():
+        for entry in ready:
+            yield encode_bundle_entry(*entry)
+        if misses:
+            async with httpx.AsyncClient() as client:
+                for filled in asyncio.as_completed([fill(client, path) for path in misses]):
+                    yield encode_bundle_entry(*(await filled))
+    
+    return StreamingResponse(bundle(), media_type=BUNDLE_MEDIA_TYPE)
 
 @app.put("/cdn/cache/{file_path:path}")
 async def put_file(file_path: str, request: FilePutRequest):
     content_bytes = request.content.encode('utf-8')
+
+    # Admit before storing anything: shedding after the write would answer 503
+    # for an object that was in fact stored, and leave the meta server behind.
+    async with meta_limiter.slot():
+        try:
+            with upstream_timer('minio', 'put'):
+                minio_client.put_object(
+                    BUCKET_NAME,
+                    file_path,
+                    io.BytesIO(content_bytes),
+                    len(content_bytes)
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"MinIO error: {str(e)}")
     
-    try:
-        minio_client.put_object(
-            BUCKET_NAME,
-            file_path,
-            io.BytesIO(content_bytes),
-            len(content_bytes)
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"MinIO error: {str(e)}")
-    
-    cache_key = f"cdn:{file_path}"
-    redis_client.set(cache_key, content_bytes)
-    local_cache.put(file_path, content_bytes)
-    
-    async with httpx.AsyncClient() as client:
-        await client.post(
-            f"{META_SERVER_URL}/meta/update",
-            json={
-                "file_name": file_path,
-                "file_hash": request.file_hash,
-                "timestamp": request.timestamp,
-                "cdn_id": CDN_ID
-            }
-        )
+        cache_key = f"cdn:{file_path}"
+        redis_client.set(cache_key, content_bytes)
+        local_cache.put(file_path, content_bytes)
+        forget_not_found(file_path)
     
+        with upstream_timer('meta', 'update'):
+            async with httpx.AsyncClient() as client:
+                await client.post(
+                    f"{META_SERVER_URL}/meta/update",
+                    json={
+                        "file_name": file_path,
+                        # Hash what was stored, as fill_from_fss does, so pulls
+                        # verify against these bytes rather than the client's claim.
+                        "file_hash": hashlib.md5(content_bytes).hexdigest(),
+                        "timestamp": request.timestamp,
+                        "cdn_id": CDN_ID
+                    }
+                )
+
     return {"status": "success", "file": file_path}
 
 @app.delete("/cdn/cache/{file_path:path}")
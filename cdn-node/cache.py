@@ -1,5 +1,14 @@
 from collections import OrderedDict
-from typing import Optional
+from contextlib import contextmanager
+from typing import List, Optional
+import fcntl
+import hashlib
+import mmap
+import os
+import random
+import struct
+import threading
+import time
 
 class LRUCache:
     def __init__(self, max_size: int = 10 * 1024 * 1024):
@@ -33,3 +42,454 @@ class LRUCache:
     def clear(self):
         self.cache.clear()
         self.current_size = 0
+
+
+class SharedMemoryCache:
+    """Slab-allocated cache in a shared mmap arena, usable by every worker on a node.
+
+    The data region is cut into pages of ``page_size`` bytes.  A page is handed
+    to a power-of-two size class the first time that class needs room and is
+    then split into chunks of that size, so small entries take small chunks and
+    the arena holds as many entries as their sizes allow.  A full class evicts
+    its least recently used sampled chunk, and a class with no pages takes one
+    over from another class.
+
+    Keys live in a set-associative index of ``ways``-slot buckets.  Buckets are
+    guarded by striped ``fcntl`` byte-range locks on the arena file and the page
+    and free-list state by one allocator lock.  A stripe lock is always taken
+    before the allocator lock, and any other stripe is only ever try-locked, so
+    workers cannot deadlock.
+    """
+
+    MAGIC = b"CDNSHMC2"
+    HEADER = struct.Struct("<8sIIII")
+    HEADER_SIZE = 64
+    # next unassigned page, entries stored, value bytes stored
+    ALLOC_STATE = struct.Struct("<IQQ")
+    # free-list head chunk, pages owned
+    CLASS_STATE = struct.Struct("<iI")
+    # state, size class, value length, key hash, chunk id, last used
+    ENTRY = struct.Struct("<BBxxIQiQ")
+    # owning index slot, next free chunk, key length, value length
+    CHUNK = struct.Struct("<iiHxxI")
+
+    EMPTY = 0
+    VALID = 1
+    UNASSIGNED = 0xFF
+    SAMPLES = 8
+
+    INIT_LOCK = 0
+    ALLOC_LOCK = 1
+
+    def __init__(
+        self,
+        path: str = "/dev/shm/cdn-local-cache",
+        max_size: int = 10 * 1024 * 1024,
+        max_item_size: int = 64 * 1024,
+        min_chunk_size: int = 256,
+        key_size: int = 256,
+        ways: int = 8,
+        stripes: int = 64,
+    ):
+        self.path = path
+        self.min_chunk_size = min_chunk_size
+        self.page_size = max(min_chunk_size, 1 << (max_item_size - 1).bit_length())
+        self.key_size = key_size
+        self.ways = ways
+        self.num_pages = max(1, max_size // self.page_size)
+        self.num_classes = (self.page_size // min_chunk_size).bit_length()
+        self.max_size = self.num_pages * self.page_size
+
+        # Enough index slots for every page to be cut into minimum-size chunks.
+        max_chunks = self.num_pages * (self.page_size // min_chunk_size)
+        self.num_buckets = max(1, -(-max_chunks // ways))
+        self.num_stripes = max(1, min(stripes, self.num_buckets))
+
+        self.alloc_offset = self.HEADER_SIZE
+        self.classes_offset = self.alloc_offset + self.ALLOC_STATE.size
+        self.pages_offset = self.classes_offset + self.num_classes * self.CLASS_STATE.size
+        self.index_offset = self.pages_offset + self.num_pages
+        self.data_offset = self.index_offset + self.num_buckets * ways * self.ENTRY.size
+        self.arena_size = self.data_offset + self.num_pages * self.page_size
+
+        self._stripe_locks = [threading.Lock() for _ in range(self.num_stripes)]
+        self._alloc_thread_lock = threading.Lock()
+        self._random = random.Random()
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._init_arena()
+        self.buf = mmap.mmap(self.fd, self.arena_size)
+
+    def _geometry(self) -> bytes:
+        return self.HEADER.pack(
+            self.MAGIC, self.num_pages, self.page_size, self.min_chunk_size, self.key_size
+        )
+
+    def _init_arena(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.INIT_LOCK)
+        try:
+            expected = self._geometry()
+            if os.fstat(self.fd).st_size == self.arena_size:
+                if os.pread(self.fd, self.HEADER.size, 0) == expected:
+                    return
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, self.arena_size)
+            with mmap.mmap(self.fd, self.arena_size) as buf:
+                self._reset(buf)
+                buf[0:self.HEADER.size] = expected
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.INIT_LOCK)
+
+    def _reset(self, buf):
+        self.ALLOC_STATE.pack_into(buf, self.alloc_offset, 0, 0, 0)
+        for size_class in range(self.num_classes):
+            self.CLASS_STATE.pack_into(
+                buf, self.classes_offset + size_class * self.CLASS_STATE.size, -1, 0
+            )
+        buf[self.pages_offset:self.index_offset] = bytes([self.UNASSIGNED]) * self.num_pages
+        buf[self.index_offset:self.data_offset] = bytes(self.data_offset - self.index_offset)
+
+    # Locking
+
+    def _lock_stripe(self, stripe: int):
+        self._stripe_locks[stripe].acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, 2 + stripe)
+
+    def _try_lock_stripe(self, stripe: int) -> bool:
+        if not self._stripe_locks[stripe].acquire(blocking=False):
+            return False
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, 2 + stripe)
+        except OSError:
+            self._stripe_locks[stripe].release()
+            return False
+        return True
+
+    def _unlock_stripe(self, stripe: int):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, 2 + stripe)
+        self._stripe_locks[stripe].release()
+
+    @contextmanager
+    def _stripe(self, stripe: int):
+        self._lock_stripe(stripe)
+        try:
+            yield
+        finally:
+            self._unlock_stripe(stripe)
+
+    @contextmanager
+    def _allocator(self):
+        with self._alloc_thread_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.ALLOC_LOCK)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.ALLOC_LOCK)
+
+    # Layout helpers
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        # Python's hash() is salted per process, so use a stable digest.
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    def _entry_offset(self, slot: int) -> int:
+        return self.index_offset + slot * self.ENTRY.size
+
+    def _chunk_offset(self, chunk: int) -> int:
+        return self.data_offset + chunk * self.min_chunk_size
+
+    def _chunk_size(self, size_class: int) -> int:
+        return self.min_chunk_size << size_class
+
+    def _size_class(self, needed: int) -> int:
+        return max(0, (needed - 1).bit_length() - self.min_chunk_size.bit_length() + 1)
+
+    def _stripe_of_slot(self, slot: int) -> int:
+        return (slot // self.ways) % self.num_stripes
+
+    def _class_state(self, size_class: int):
+        return self.CLASS_STATE.unpack_from(
+            self.buf, self.classes_offset + size_class * self.CLASS_STATE.size
+        )
+
+    def _set_class_state(self, size_class: int, free_head: int, pages: int):
+        self.CLASS_STATE.pack_into(
+            self.buf, self.classes_offset + size_class * self.CLASS_STATE.size, free_head, pages
+        )
+
+    def _adjust_usage(self, entries: int, value_bytes: int):
+        next_page, stored, stored_bytes = self.ALLOC_STATE.unpack_from(self.buf, self.alloc_offset)
+        self.ALLOC_STATE.pack_into(
+            self.buf, self.alloc_offset, next_page, stored + entries, stored_bytes + value_bytes
+        )
+
+    # Allocator; every method below runs under the allocator lock.
+
+    def _push_free(self, size_class: int, chunk: int):
+        free_head, pages = self._class_state(size_class)
+        self.CHUNK.pack_into(self.buf, self._chunk_offset(chunk), -1, free_head, 0, 0)
+        self._set_class_state(size_class, chunk, pages)
+
+    def _pop_free(self, size_class: int) -> Optional[int]:
+        free_head, pages = self._class_state(size_class)
+        if free_head == -1:
+            return None
+        _, next_free, _, _ = self.CHUNK.unpack_from(self.buf, self._chunk_offset(free_head))
+        self._set_class_state(size_class, next_free, pages)
+        return free_head
+
+    def _carve(self, page: int, size_class: int):
+        self.buf[self.pages_offset + page] = size_class
+        free_head, pages = self._class_state(size_class)
+        self._set_class_state(size_class, free_head, pages + 1)
+        step = self._chunk_size(size_class) // self.min_chunk_size
+        first = page * (self.page_size // self.min_chunk_size)
+        for chunk in range(first + (self.page_size // self.min_chunk_size) - step, first - 1, -step):
+            self._push_free(size_class, chunk)
+
+    def _pages_of(self, size_class: int) -> List[int]:
+        table = self.buf[self.pages_offset:self.index_offset]
+        return [page for page, owner in enumerate(table) if owner == size_class]
+
+    def _release_slot(self, slot: int, held_stripe: int) -> bool:
+        """Drop the index entry at ``slot`` without freeing its chunk."""
+        stripe = self._stripe_of_slot(slot)
+        if stripe != held_stripe and not self._try_lock_stripe(stripe):
+            return False
+        try:
+            state, _, value_len, _, _, _ = self.ENTRY.unpack_from(self.buf, self._entry_offset(slot))
+            if state == self.VALID:
+                self.buf[self._entry_offset(slot)] = self.EMPTY
+                self._adjust_usage(-1, -value_len)
+            return True
+        finally:
+            if stripe != held_stripe:
+                self._unlock_stripe(stripe)
+
+    def _evict_from_class(self, size_class: int, held_stripe: int) -> Optional[int]:
+        pages = self._pages_of(size_class)
+        if not pages:
+            return None
+        per_page = self.page_size // self._chunk_size(size_class)
+        step = self._chunk_size(size_class) // self.min_chunk_size
+        candidates = []
+        for _ in range(self.SAMPLES):
+            page = self._random.choice(pages)
+            chunk = page * (self.page_size // self.min_chunk_size) + self._random.randrange(per_page) * step
+            owner, _, _, _ = self.CHUNK.unpack_from(self.buf, self._chunk_offset(chunk))
+            if owner < 0:
+                continue
+            _, _, _, _, _, last_used = self.ENTRY.unpack_from(self.buf, self._entry_offset(owner))
+            candidates.append((last_used, chunk, owner))
+
+        for _, chunk, owner in sorted(set(candidates)):
+            # The owner is read without its stripe lock, so re-check it once locked.
+            current, _, _, _ = self.CHUNK.unpack_from(self.buf, self._chunk_offset(chunk))
+            if current != owner or not self._release_slot(owner, held_stripe):
+                continue
+            self.CHUNK.pack_into(self.buf, self._chunk_offset(chunk), -1, -1, 0, 0)
+            return chunk
+        return None
+
+    def _steal_page(self, size_class: int, held_stripe: int) -> bool:
+        table = self.buf[self.pages_offset:self.index_offset]
+        pages = [page for page, owner in enumerate(table) if owner not in (size_class, self.UNASSIGNED)]
+        self._random.shuffle(pages)
+        chunks_per_page = self.page_size // self.min_chunk_size
+        for page in pages[:self.SAMPLES]:
+            victim_class = table[page]
+            step = self._chunk_size(victim_class) // self.min_chunk_size
+            first = page * chunks_per_page
+            chunks = range(first, first + chunks_per_page, step)
+            owners = []
+            for chunk in chunks:
+                owner, _, _, _ = self.CHUNK.unpack_from(self.buf, self._chunk_offset(chunk))
+                if owner >= 0:
+                    owners.append(owner)
+
+            stripes = sorted({self._stripe_of_slot(owner) for owner in owners} - {held_stripe})
+            locked = []
+            for stripe in stripes:
+                if not self._try_lock_stripe(stripe):
+                    break
+                locked.append(stripe)
+            try:
+                if len(locked) != len(stripes):
+                    continue
+                for owner in owners:
+                    self._release_slot(owner, self._stripe_of_slot(owner))
+            finally:
+                for stripe in locked:
+                    self._unlock_stripe(stripe)
+
+            # Rebuild the victim class's free list without this page's chunks.
+            free = []
+            chunk = self._class_state(victim_class)[0]
+            while chunk != -1:
+                if not first <= chunk < first + chunks_per_page:
+                    free.append(chunk)
+                chunk = self.CHUNK.unpack_from(self.buf, self._chunk_offset(chunk))[1]
+            _, victim_pages = self._class_state(victim_class)
+            self._set_class_state(victim_class, -1, victim_pages - 1)
+            for chunk in reversed(free):
+                self._push_free(victim_class, chunk)
+
+            self._carve(page, size_class)
+            return True
+        return False
+
+    def _allocate(self, size_class: int, held_stripe: int, slot: int) -> Optional[int]:
+        with self._allocator():
+            chunk = self._take_chunk(size_class, held_stripe)
+            if chunk is not None:
+                # Claim the chunk for ``slot`` before the allocator lock is dropped.
+                # Evictors must then lock the slot's stripe, which the caller holds,
+                # so the chunk cannot be reclaimed before the entry is written.
+                self.CHUNK.pack_into(self.buf, self._chunk_offset(chunk), slot, -1, 0, 0)
+            return chunk
+
+    def _take_chunk(self, size_class: int, held_stripe: int) -> Optional[int]:
+        chunk = self._pop_free(size_class)
+        if chunk is not None:
+            return chunk
+        next_page, stored, stored_bytes = self.ALLOC_STATE.unpack_from(self.buf, self.alloc_offset)
+        if next_page < self.num_pages:
+            self.ALLOC_STATE.pack_into(self.buf, self.alloc_offset, next_page + 1, stored, stored_bytes)
+            self._carve(next_page, size_class)
+            return self._pop_free(size_class)
+        chunk = self._evict_from_class(size_class, held_stripe)
+        if chunk is not None:
+            return chunk
+        if self._steal_page(size_class, held_stripe):
+            return self._pop_free(size_class)
+        return None
+
+    # Index; every method below runs under the key's stripe lock.
+
+    def _find(self, bucket: int, key_hash: int, key: bytes) -> Optional[int]:
+        for slot in range(bucket * self.ways, (bucket + 1) * self.ways):
+            state, _, _, slot_hash, chunk, _ = self.ENTRY.unpack_from(self.buf, self._entry_offset(slot))
+            if state != self.VALID or slot_hash != key_hash:
+                continue
+            offset = self._chunk_offset(chunk)
+            _, _, key_len, _ = self.CHUNK.unpack_from(self.buf, offset)
+            key_start = offset + self.CHUNK.size
+            if self.buf[key_start:key_start + key_len] == key:
+                return slot
+        return None
+
+    def _remove(self, slot: int):
+        state, size_class, value_len, _, chunk, _ = self.ENTRY.unpack_from(self.buf, self._entry_offset(slot))
+        if state != self.VALID:
+            return
+        self.buf[self._entry_offset(slot)] = self.EMPTY
+        with self._allocator():
+            self._adjust_usage(-1, -value_len)
+            self._push_free(size_class, chunk)
+
+    def _free_slot(self, bucket: int) -> int:
+        victim, oldest = None, None
+        for slot in range(bucket * self.ways, (bucket + 1) * self.ways):
+            state, _, _, _, _, last_used = self.ENTRY.unpack_from(self.buf, self._entry_offset(slot))
+            if state != self.VALID:
+                return slot
+            if oldest is None or last_used < oldest:
+                victim, oldest = slot, last_used
+        self._remove(victim)
+        return victim
+
+    def _locate(self, key: str):
+        key_bytes = key.encode("utf-8")
+        key_hash = self._hash(key_bytes)
+        bucket = key_hash % self.num_buckets
+        return key_bytes, key_hash, bucket, bucket % self.num_stripes
+
+    def get(self, key: str) -> Optional[bytes]:
+        key_bytes, key_hash, bucket, stripe = self._locate(key)
+        if len(key_bytes) > self.key_size:
+            return None
+        with self._stripe(stripe):
+            slot = self._find(bucket, key_hash, key_bytes)
+            if slot is None:
+                return None
+            offset = self._entry_offset(slot)
+            state, size_class, value_len, slot_hash, chunk, _ = self.ENTRY.unpack_from(self.buf, offset)
+            self.ENTRY.pack_into(
+                self.buf, offset, state, size_class, value_len, slot_hash, chunk, time.monotonic_ns()
+            )
+            value_start = self._chunk_offset(chunk) + self.CHUNK.size + len(key_bytes)
+            return self.buf[value_start:value_start + value_len]
+
+    def put(self, key: str, value: bytes):
+        key_bytes, key_hash, bucket, stripe = self._locate(key)
+        needed = self.CHUNK.size + len(key_bytes) + len(value)
+        with self._stripe(stripe):
+            # Never leave an older version of the key behind, even if the new one is not cached.
+            slot = self._find(bucket, key_hash, key_bytes)
+            if slot is not None:
+                self._remove(slot)
+            if len(key_bytes) > self.key_size or needed > self.page_size:
+                return
+
+            size_class = self._size_class(needed)
+            slot = self._free_slot(bucket)
+            chunk = self._allocate(size_class, stripe, slot)
+            if chunk is None:
+                return
+
+            offset = self._chunk_offset(chunk)
+            self.CHUNK.pack_into(self.buf, offset, slot, -1, len(key_bytes), len(value))
+            key_start = offset + self.CHUNK.size
+            self.buf[key_start:key_start + len(key_bytes)] = key_bytes
+            value_start = key_start + len(key_bytes)
+            self.buf[value_start:value_start + len(value)] = value
+            # The entry becomes visible only after the chunk is fully written.
+            self.ENTRY.pack_into(
+                self.buf, self._entry_offset(slot), self.VALID, size_class, len(value),
+                key_hash, chunk, time.monotonic_ns()
+            )
+            with self._allocator():
+                self._adjust_usage(1, len(value))
+
+    def delete(self, key: str):
+        key_bytes, key_hash, bucket, stripe = self._locate(key)
+        if len(key_bytes) > self.key_size:
+            return
+        with self._stripe(stripe):
+            slot = self._find(bucket, key_hash, key_bytes)
+            if slot is not None:
+                self._remove(slot)
+
+    def clear(self):
+        for stripe in range(self.num_stripes):
+            self._lock_stripe(stripe)
+        try:
+            with self._allocator():
+                self._reset(self.buf)
+        finally:
+            for stripe in reversed(range(self.num_stripes)):
+                self._unlock_stripe(stripe)
+
+    @property
+    def current_size(self) -> int:
+        return self.ALLOC_STATE.unpack_from(self.buf, self.alloc_offset)[2]
+
+    def __len__(self) -> int:
+        return self.ALLOC_STATE.unpack_from(self.buf, self.alloc_offset)[1]
+
+    def close(self):
+        self.buf.close()
+        os.close(self.fd)
+
+
+def create_local_cache(
+    backend: str = "memory",
+    max_size: int = 10 * 1024 * 1024,
+    **shared_options,
+):
+    if backend == "memory":
+        return LRUCache(max_size=max_size)
+    if backend == "shared":
+        return SharedMemoryCache(max_size=max_size, **shared_options)
+    raise ValueError(f"Unknown local cache backend: {backend}")
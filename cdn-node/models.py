@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import List
 
 class FilePutRequest(BaseModel):
     content: str
@@ -8,3 +9,6 @@ class FilePutRequest(BaseModel):
 class FileGetResponse(BaseModel):
     content: str
     source: str
+
+class BatchGetRequest(BaseModel):
+    paths: List[str]
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionLimiter, Overloaded
+
+
+async def hold(limiter: AdmissionLimiter, entered: asyncio.Event, release: asyncio.Event):
+    async with limiter.slot():
+        entered.set()
+        await release.wait()
+
+
+def test_sheds_once_the_queue_is_full():
+    async def scenario():
+        limiter = AdmissionLimiter("fss", max_concurrency=1, max_queue=1, queue_timeout=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, entered, release))
+        await entered.wait()
+        waiter = asyncio.create_task(hold(limiter, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+
+        with pytest.raises(Overloaded):
+            async with limiter.slot():
+                pass
+        assert limiter.shed == 1
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert limiter.admitted == 2
+        assert (limiter.in_flight, limiter.queued) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_times_out_after_queue_timeout():
+    async def scenario():
+        limiter = AdmissionLimiter("fss", max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, entered, release))
+        await entered.wait()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(Overloaded):
+            async with limiter.slot():
+                pass
+        assert loop.time() - start >= 0.05
+        assert limiter.timeouts == 1
+        assert limiter.queued == 0
+
+        release.set()
+        await holder
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_no_accounting_behind():
+    async def scenario():
+        limiter = AdmissionLimiter("fss", max_concurrency=1, max_queue=4, queue_timeout=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, entered, release))
+        await entered.wait()
+
+        waiter = asyncio.create_task(hold(limiter, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.queued == 0
+
+        release.set()
+        await holder
+        assert (limiter.in_flight, limiter.queued) == (0, 0)
+        async with limiter.slot():
+            assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_permit_is_released_when_the_body_raises():
+    async def scenario():
+        limiter = AdmissionLimiter("fss", max_concurrency=1, max_queue=0, queue_timeout=5)
+        with pytest.raises(RuntimeError):
+            async with limiter.slot():
+                raise RuntimeError("upstream failed")
+        assert limiter.in_flight == 0
+        assert not limiter.semaphore.locked()
+
+        # With no queue, a leaked permit would shed this call.
+        async with limiter.slot():
+            assert limiter.in_flight == 1
+        assert limiter.shed == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+import multiprocessing
+import random
+
+import pytest
+
+from cache import LRUCache, SharedMemoryCache
+
+
+@pytest.fixture
+def arena(tmp_path):
+    return str(tmp_path / "arena")
+
+
+def test_small_entries_fill_the_arena_like_lru(arena):
+    shared = SharedMemoryCache(path=arena, max_size=10 * 1024 * 1024)
+    lru = LRUCache(max_size=10 * 1024 * 1024)
+    for i in range(2000):
+        shared.put(f"file-{i}", b"x" * 1024)
+        lru.put(f"file-{i}", b"x" * 1024)
+
+    assert len(shared) == len(lru.cache) == 2000
+    assert shared.current_size == lru.current_size
+    assert all(shared.get(f"file-{i}") == b"x" * 1024 for i in range(2000))
+
+
+def test_eviction_keeps_usage_within_capacity(arena):
+    cache = SharedMemoryCache(path=arena, max_size=1024 * 1024)
+    rng = random.Random(0)
+    for i in range(3000):
+        cache.put(f"key-{i}", bytes([i % 256]) * rng.choice([100, 1000, 5000, 30000]))
+
+    assert 0 < cache.current_size <= cache.max_size
+    for i in range(3000):
+        value = cache.get(f"key-{i}")
+        if value is not None:
+            assert set(value) == {i % 256}
+
+
+def test_overwrite_delete_and_oversize(arena):
+    cache = SharedMemoryCache(path=arena, max_size=1024 * 1024, max_item_size=4096)
+    cache.put("a", b"small")
+    cache.put("a", b"y" * 3000)
+    assert cache.get("a") == b"y" * 3000
+    assert len(cache) == 1
+
+    cache.put("a", b"z" * 10000)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+    cache.put("b", b"value")
+    cache.delete("b")
+    assert cache.get("b") is None
+
+    cache.put("c", b"value")
+    cache.clear()
+    assert cache.get("c") is None
+    assert cache.current_size == 0
+
+
+def test_page_moves_to_a_starved_size_class(arena):
+    cache = SharedMemoryCache(path=arena, max_size=256 * 1024, max_item_size=64 * 1024)
+    for i in range(2000):
+        cache.put(f"small-{i}", b"s" * 100)
+    cache.put("large", b"L" * 60000)
+    assert cache.get("large") == b"L" * 60000
+
+
+def _writer(path: str, worker: int):
+    cache = SharedMemoryCache(path=path, max_size=1024 * 1024)
+    rng = random.Random(worker)
+    for i in range(500):
+        cache.put(f"w{worker}-{i}", f"{worker}:{i}:".encode() * rng.choice([1, 50, 500]))
+        cache.get(f"w{(worker + 1) % 4}-{i}")
+
+
+def test_workers_share_one_arena(arena):
+    cache = SharedMemoryCache(path=arena, max_size=1024 * 1024)
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_writer, args=(arena, worker)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    found = 0
+    for worker in range(4):
+        for i in range(500):
+            value = cache.get(f"w{worker}-{i}")
+            if value is not None:
+                found += 1
+                assert value.startswith(f"{worker}:{i}:".encode())
+    assert found > 0
+    assert cache.current_size <= cache.max_size
+
+    other = SharedMemoryCache(path=arena, max_size=1024 * 1024)
+    other.put("from-other", b"shared")
+    assert cache.get("from-other") == b"shared"
+
@@ -3,9 +3,67 @@ import hashlib
 import os
 import time
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 import asyncio
 import argparse
+import json
+
+class HashMismatch(Exception):
+    def __init__(self, file_name: str, expected: str, actual: str):
+        super().__init__(f"Hash mismatch for {file_name}: expected {expected}, got {actual}")
+
+class IncompleteListing(Exception):
+    pass
+
+def retry_after(response: httpx.Response, default: float = 1.0) -> float:
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', default)))
+    except ValueError:
+        return default
+
+class LocationCache:
+    """Resolved file locations persisted to disk with a TTL, so repeated pulls
+    skip the origin round trip for files they already know about.
+
+    Only the serving node is cached.  File hashes change whenever a file is
+    republished, so they always come fresh from the origin.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = Path(path).expanduser()
+        self.ttl = ttl
+        self.entries = {}
+        if ttl > 0 and self.path.exists():
+            try:
+                self.entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self.entries = {}
+    
+    def get(self, file_name: str) -> Optional[Dict]:
+        entry = self.entries.get(file_name)
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return {"cdn_address": entry['cdn_address'], "cdn_id": entry['cdn_id']}
+    
+    def put(self, file_name: str, location: Dict):
+        if self.ttl <= 0:
+            return
+        self.entries[file_name] = {
+            "cdn_address": location['cdn_address'],
+            "cdn_id": location['cdn_id'],
+            "expires_at": time.time() + self.ttl
+        }
+    
+    def invalidate(self, file_name: str):
+        self.entries.pop(file_name, None)
+    
+    def save(self):
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        live = {name: entry for name, entry in self.entries.items() if entry['expires_at'] > now}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(live))
 
 class CDNClient:
     def __init__(self, origin_url: str, client_lat: float, client_lng: float):
@@ -49,49 +107,44 @@ class CDNClient:
         
         print(f"Found {len(files)} files")
         
-        request_payload = {
-            "Type": 0,
-            "FileList": [{"Name": f["Name"], "Hash": f["Hash"], "TimeStamp": f["TimeStamp"]} for f in files],
-            "IP": self.client_ip,
-            "Lat": self.client_lat,
-            "Lng": self.client_lng
-        }
+        file_list = [{"Name": f["Name"], "Hash": f["Hash"], "TimeStamp": f["TimeStamp"]} for f in files]
         
         async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(f"{self.origin_url}/origin/sync", json=request_payload)
+            try:
+                located = await self.query_origin(client, 0, file_list)
+            except httpx.HTTPError as e:
+                print(f"Error: {str(e)}")
+                return
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"\nReceived CDN addresses for {len(result['files'])} files")
+            print(f"\nReceived CDN addresses for {len(located)} files")
+            
+            for file_info in located:
+                file_name = file_info['file_name']
+                cdn_address = file_info['cdn_address']
+                cdn_id = file_info.get('cdn_id', -1)
                 
-                for file_info in result['files']:
-                    file_name = file_info['file_name']
-                    cdn_address = file_info['cdn_address']
-                    cdn_id = file_info.get('cdn_id', -1)
-                    
-                    matching_file = next((f for f in files if f['Name'] == file_name), None)
-                    if matching_file:
-                        if cdn_id == -1:
-                            # Upload to FSS
-                            await self.upload_file_to_fss(
-                                matching_file['FullPath'],
-                                file_name,
-                                cdn_address
-                            )
-                        else:
-                            # Upload to CDN
-                            await self.upload_file_to_cdn(
-                                matching_file['FullPath'],
-                                file_name,
-                                matching_file['Hash'],
-                                matching_file['TimeStamp'],
-                                cdn_address
-                            )
-            else:
-                print(f"Error: {response.status_code} - {response.text}")
+                matching_file = next((f for f in files if f['Name'] == file_name), None)
+                if matching_file:
+                    if cdn_id == -1:
+                        # Upload to FSS
+                        await self.upload_file_to_fss(
+                            matching_file['FullPath'],
+                            file_name,
+                            cdn_address
+                        )
+                    else:
+                        # Upload to CDN
+                        await self.upload_file_to_cdn(
+                            matching_file['FullPath'],
+                            file_name,
+                            matching_file['Hash'],
+                            matching_file['TimeStamp'],
+                            cdn_address
+                        )
 
     async def upload_file_to_fss(self, file_path: str, file_name: str, fss_address: str):
-        with open(file_path, 'r') as f:
+        # Send the bytes calculate_file_hash saw; text mode would rewrite CRLF.
+        with open(file_path, 'rb') as f:
             content = f.read()
         
         fss_url = f"http://{fss_address}/post/{file_name}"
@@ -110,8 +163,8 @@ class CDNClient:
     
     async def upload_file_to_cdn(self, file_path: str, file_name: str, file_hash: str, timestamp: str, cdn_address: str):
 
-        with open(file_path, 'r') as f:
-            content = f.read()
+        with open(file_path, 'rb') as f:
+            content = f.read().decode('utf-8')
         
         cdn_url = f"http://{cdn_address}/cdn/cache/{file_name}"
         
@@ -166,15 +219,187 @@ class CDNClient:
             else:
                 print(f"Error: {response.status_code} - {response.text}")
 
+    async def list_remote_files(self, fss_url: str, prefix: str) -> List[str]:
+        names = []
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            async with client.stream("GET", f"{fss_url}/list/stream", params={"prefix": prefix}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if record.get('end'):
+                        return names
+                    if 'error' in record:
+                        raise IncompleteListing(f"Listing failed after {len(names)} files: {record['error']}")
+                    names.append(record['name'])
+        # Without the closing record the stream was cut off and the list is partial.
+        raise IncompleteListing(f"Listing ended after {len(names)} files without an end record")
+    
+    async def query_origin(self, client: httpx.AsyncClient, request_type: int, file_list: List[Dict],
+                           attempts: int = 5) -> List[Dict]:
+        """POST ``file_list`` to /origin/sync and return the located files.
+
+        Files the origin sheds, whether the whole request (503) or the ones it
+        hands back in ``retry``, are sent again after its ``Retry-After``, up to
+        ``attempts`` requests in total.  Other failures raise ``httpx.HTTPError``.
+        """
+        located = []
+        pending = file_list
+        for attempt in range(1, attempts + 1):
+            request_payload = {
+                "Type": request_type,
+                "FileList": pending,
+                "IP": self.client_ip,
+                "Lat": self.client_lat,
+                "Lng": self.client_lng
+            }
+            response = await client.post(f"{self.origin_url}/origin/sync", json=request_payload)
+            if response.status_code == 503:
+                retry = {f["Name"] for f in pending}
+            else:
+                response.raise_for_status()
+                result = response.json()
+                located.extend(result['files'])
+                retry = set(result.get('retry', []))
+            
+            pending = [f for f in pending if f["Name"] in retry]
+            if not pending:
+                break
+            if attempt == attempts:
+                print(f"✗ Origin overloaded, giving up on {len(pending)} files")
+                break
+            delay = retry_after(response) * attempt
+            print(f"Origin overloaded, retrying {len(pending)} files in {delay:g}s")
+            await asyncio.sleep(delay)
+        return located
+    
+    async def resolve_locations(self, client: httpx.AsyncClient, file_names: List[str],
+                                cache: LocationCache, need_hash=frozenset(),
+                                attempts: int = 5) -> Dict[str, Dict]:
+        """Locate ``file_names``, asking the origin only about uncached files and
+        those in ``need_hash``.  Only origin answers carry a ``file_hash``.
+
+        Files the origin sheds are retried after its ``Retry-After``, up to
+        ``attempts`` requests in total."""
+        locations = {}
+        unresolved = []
+        for file_name in file_names:
+            entry = cache.get(file_name)
+            if entry:
+                locations[file_name] = entry
+            if entry is None or file_name in need_hash:
+                unresolved.append(file_name)
+        
+        if unresolved:
+            file_list = [{"Name": name, "Hash": "", "TimeStamp": "0"} for name in unresolved]
+            try:
+                resolved = await self.query_origin(client, 1, file_list, attempts)
+            except httpx.HTTPError as e:
+                print(f"✗ Error resolving {len(unresolved)} files: {str(e)}")
+                return locations
+            for file_info in resolved:
+                location = {
+                    "cdn_address": file_info['cdn_address'],
+                    "cdn_id": file_info.get('cdn_id', -1)
+                }
+                cache.put(file_info['file_name'], location)
+                locations[file_info['file_name']] = {**location, "file_hash": file_info.get('file_hash', "")}
+        
+        return locations
+    
+    async def download_file(self, client: httpx.AsyncClient, file_name: str, location: Dict,
+                            target: Path, expected_hash: str = "") -> str:
+        if location['cdn_id'] == -1:
+            url = f"http://{location['cdn_address']}/get/{file_name}"
+        else:
+            url = f"http://{location['cdn_address']}/cdn/cache/{file_name}"
+        
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.part")
+        hasher = hashlib.md5()
+        try:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes():
+                        f.write(chunk)
+                        hasher.update(chunk)
+            if expected_hash and hasher.hexdigest() != expected_hash:
+                raise HashMismatch(file_name, expected_hash, hasher.hexdigest())
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return hasher.hexdigest()
+    
+    async def pull_files(self, file_names: List[str], destination: str, concurrency: int = 8,
+                         cache: Optional[LocationCache] = None):
+        cache = cache or LocationCache("~/.cdn_client/locations.json", ttl=0)
+        dest = Path(destination).resolve()
+        counts = {"pulled": 0, "skipped": 0, "failed": 0}
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+            # Files already on disk need a current hash to decide whether to skip them.
+            present = {name for name in file_names if (dest / name).is_file()}
+            locations = await self.resolve_locations(client, file_names, cache, present)
+            
+            async def pull_one(file_name: str):
+                target = (dest / file_name).resolve()
+                if dest not in target.parents:
+                    print(f"✗ Refusing to write outside {dest}: {file_name}")
+                    counts["failed"] += 1
+                    return
+                
+                location = locations.get(file_name)
+                if location is None:
+                    print(f"✗ No location for {file_name}")
+                    counts["failed"] += 1
+                    return
+                
+                remote_hash = location.get('file_hash', "")
+                if remote_hash and target.is_file():
+                    if await asyncio.to_thread(self.calculate_file_hash, str(target)) == remote_hash:
+                        counts["skipped"] += 1
+                        return
+                
+                async with semaphore:
+                    try:
+                        await self.download_file(client, file_name, location, target, remote_hash)
+                    except (httpx.HTTPError, HashMismatch) as e:
+                        # The cached location may be stale; forget it so the next pull re-resolves.
+                        cache.invalidate(file_name)
+                        print(f"✗ Error pulling {file_name}: {str(e)}")
+                        counts["failed"] += 1
+                        return
+                
+                counts["pulled"] += 1
+            
+            await asyncio.gather(*(pull_one(name) for name in file_names))
+        
+        cache.save()
+        print(f"Pulled {counts['pulled']}, skipped {counts['skipped']} unchanged, failed {counts['failed']}")
+        return counts
+
 async def main():
     parser = argparse.ArgumentParser(description='CDN Client')
-    parser.add_argument('command', choices=['sync', 'get'], help='Command to execute')
-    parser.add_argument('path', help='Directory path for sync or file name for get')
+    parser.add_argument('command', choices=['sync', 'get', 'pull'], help='Command to execute')
+    parser.add_argument('path', nargs='?', default='', help='Directory path for sync, file name for get, or prefix for pull')
     parser.add_argument('--origin', default='http://localhost:8001', help='Origin server URL')
     parser.add_argument('--lat', type=float, default=37.7749, help='Client latitude')
     parser.add_argument('--lng', type=float, default=-122.4194, help='Client longitude')
+    parser.add_argument('--dest', default='.', help='Destination directory for pull')
+    parser.add_argument('--list', dest='list_file', help='File with one file name per line to pull instead of a prefix')
+    parser.add_argument('--fss', default='http://localhost:5050', help='FSS URL used to list files by prefix')
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel downloads for pull')
+    parser.add_argument('--location-cache', default='~/.cdn_client/locations.json', help='Resolved location cache file')
+    parser.add_argument('--location-ttl', type=float, default=300, help='Seconds to reuse resolved locations (0 disables)')
     
     args = parser.parse_args()
+    if args.command != 'pull' and not args.path:
+        parser.error(f"{args.command} requires a path")
     
     client = CDNClient(args.origin, args.lat, args.lng)
     
@@ -182,6 +407,23 @@ async def main():
         await client.sync_directory(args.path)
     elif args.command == 'get':
         await client.get_file_explicit(args.path)
+    elif args.command == 'pull':
+        if args.list_file:
+            with open(args.list_file) as f:
+                file_names = [line.strip() for line in f if line.strip()]
+        else:
+            try:
+                file_names = await client.list_remote_files(args.fss, args.path)
+            except (httpx.HTTPError, IncompleteListing) as e:
+                print(f"✗ Error listing {args.path or 'all files'}: {str(e)}")
+                return
+        
+        if not file_names:
+            print("No files to pull")
+            return
+        
+        cache = LocationCache(args.location_cache, args.location_ttl)
+        await client.pull_files(file_names, args.dest, args.concurrency, cache)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -29,3 +29,5 @@ CREATE TABLE IF NOT EXISTS file_timestamps (
 CREATE INDEX IF NOT EXISTS idx_cdn_file_mappings_file ON cdn_file_mappings(file_name);
 CREATE INDEX IF NOT EXISTS idx_cdn_file_mappings_cdn ON cdn_file_mappings(cdn_id);
 CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash);
+-- Byte-order index for keyset pagination and prefix (LIKE 'abc%') listings
+CREATE INDEX IF NOT EXISTS idx_files_name_c ON files(name COLLATE "C");
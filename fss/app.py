@@ -1,14 +1,20 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import PlainTextResponse
-from fastapi import Body
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi import Body, Query
+from typing import Optional
 import httpx
+import hashlib
+import json
 import os
-from storage import MinIOStorage
+from storage import create_storage
+from metrics import install_metrics, upstream_timer
 
 app = FastAPI()
-storage = MinIOStorage()
+install_metrics(app)
+storage = create_storage()
 
 META_SERVER_URL = os.getenv('META_SERVER_URL', 'http://meta-server:8002')
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
 
 @app.get("/health")
 def health_check():
@@ -17,7 +23,8 @@ def health_check():
 @app.get("/get/{file_path:path}", response_class=PlainTextResponse)
 def get_file(file_path: str):
     try:
-        content = storage.get_file(file_path)
+        with upstream_timer('minio', 'get'):
+            content = storage.get_file(file_path)
         return content.decode('utf-8')
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
@@ -28,18 +35,20 @@ def get_file(file_path: str):
 async def post_file(file_path: str, content: str = Body(..., media_type="text/plain")):
     try:
         content_bytes = content.encode('utf-8')
-        storage.put_file(file_path, content_bytes)
+        with upstream_timer('minio', 'put'):
+            storage.put_file(file_path, content_bytes)
         
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{META_SERVER_URL}/meta/update",
-                json={
-                    "file_name": file_path,
-                    "file_hash": "",
-                    "timestamp": "0",
-                    "cdn_id": -1
-                }
-            )
+        with upstream_timer('meta', 'update'):
+            async with httpx.AsyncClient() as client:
+                await client.post(
+                    f"{META_SERVER_URL}/meta/update",
+                    json={
+                        "file_name": file_path,
+                        "file_hash": hashlib.md5(content_bytes).hexdigest(),
+                        "timestamp": "0",
+                        "cdn_id": -1
+                    }
+                )
         
         return {"status": "success", "file": file_path}
     except Exception as e:
@@ -48,27 +57,50 @@ async def post_file(file_path: str, content: str = Body(..., media_type="text/pl
 @app.delete("/delete/{file_path:path}")
 async def delete_file(file_path: str):
     try:
-        storage.delete_file(file_path)
+        with upstream_timer('minio', 'delete'):
+            storage.delete_file(file_path)
         
-        async with httpx.AsyncClient() as client:
-            await client.request(
-                "DELETE",
-                f"{META_SERVER_URL}/meta/delete",
-                json={"file_name": file_path}
-            )
+        with upstream_timer('meta', 'delete'):
+            async with httpx.AsyncClient() as client:
+                await client.request(
+                    "DELETE",
+                    f"{META_SERVER_URL}/meta/delete",
+                    json={"file_name": file_path}
+                )
         
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/list")
-def list_files():
+def list_files(
+    prefix: str = "",
+    start_after: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
     try:
-        files = storage.list_files()
-        return {"files": files}
+        with upstream_timer('minio', 'list'):
+            files = storage.list_files(prefix, start_after, limit)
+        next_start_after = files[-1] if len(files) == limit else None
+        return {"files": files, "next_start_after": next_start_after}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/list/stream")
+def stream_files(prefix: str = "", start_after: Optional[str] = None):
+    def lines():
+        # The status line is long gone by the time a page fails, so the stream
+        # ends with a record a client can check: {"end": true} or {"error": ...}.
+        try:
+            for name in storage.iter_files(prefix, start_after):
+                yield json.dumps({"name": name}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        yield json.dumps({"end": True}) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5050)
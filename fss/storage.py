@@ -1,6 +1,11 @@
 from minio import Minio
+from minio.error import S3Error
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional
 import os
 import io
+import tempfile
 
 class MinIOStorage:
     def __init__(self):
@@ -29,8 +34,11 @@ class MinIOStorage:
             response.close()
             response.release_conn()
             return data
-        except Exception as e:
-            raise FileNotFoundError(f"File {file_name} not found: {str(e)}")
+        except S3Error as e:
+            # Only a missing key is a 404; anything else is an outage the caller must not cache.
+            if e.code == 'NoSuchKey':
+                raise FileNotFoundError(f"File {file_name} not found: {str(e)}")
+            raise
     
     def put_file(self, file_name: str, content: bytes):
         self.client.put_object(
@@ -43,6 +51,98 @@ class MinIOStorage:
     def delete_file(self, file_name: str):
         self.client.remove_object(self.bucket_name, file_name)
     
-    def list_files(self):
-        objects = self.client.list_objects(self.bucket_name, recursive=True)
-        return [obj.object_name for obj in objects]
+    def iter_files(self, prefix: str = "", start_after: Optional[str] = None) -> Iterator[str]:
+        # MinIO pages through the bucket lazily and returns keys in lexicographic order.
+        objects = self.client.list_objects(
+            self.bucket_name,
+            prefix=prefix or None,
+            recursive=True,
+            start_after=start_after
+        )
+        for obj in objects:
+            yield obj.object_name
+    
+    def list_files(self, prefix: str = "", start_after: Optional[str] = None, limit: Optional[int] = None):
+        return list(islice(self.iter_files(prefix, start_after), limit))
+
+
+class FilesystemStorage:
+    """Stores objects as plain files under ``root``, mirroring MinIOStorage.
+
+    Intended for local development and benchmarking without a MinIO server.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = Path(root or os.getenv('STORAGE_ROOT', '/tmp/cdn-files')).resolve()
+        # Writes land in a staging directory first so readers never see a partial file.
+        self.staging = self.root / '.staging'
+        self.staging.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, file_name: str) -> Path:
+        path = (self.root / file_name).resolve()
+        if self.root not in path.parents:
+            raise FileNotFoundError(f"File {file_name} is outside the storage root")
+        return path
+
+    def get_file(self, file_name: str) -> bytes:
+        try:
+            return self._path(file_name).read_bytes()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError) as e:
+            raise FileNotFoundError(f"File {file_name} not found: {str(e)}")
+
+    def put_file(self, file_name: str, content: bytes):
+        path = self._path(file_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def delete_file(self, file_name: str):
+        self._path(file_name).unlink(missing_ok=True)
+
+    def _walk(self, directory: str, base: str, prefix: str, start_after: Optional[str]) -> Iterator[str]:
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path != str(self.staging):
+                        # Sorting directories as "name/" puts their contents where
+                        # those full names fall among their siblings.
+                        entries.append((base + entry.name + '/', entry.path))
+                elif entry.is_file():
+                    entries.append((base + entry.name, None))
+        entries.sort()
+        for name, subdirectory in entries:
+            if subdirectory is None:
+                if not start_after or name > start_after:
+                    yield name
+            # Every name below a directory starts with "name/", so skip subtrees
+            # outside the prefix or entirely before start_after.
+            elif not (name.startswith(prefix) or prefix.startswith(name)):
+                continue
+            elif start_after and name < start_after and not start_after.startswith(name):
+                continue
+            else:
+                yield from self._walk(subdirectory, name, prefix, start_after)
+
+    def iter_files(self, prefix: str = "", start_after: Optional[str] = None) -> Iterator[str]:
+        # Directories are read in name order and pruned, so a page costs the
+        # directories it passes through rather than a sort of the whole tree.
+        for name in self._walk(str(self.root), "", prefix, start_after):
+            if name.startswith(prefix):
+                yield name
+            elif name > prefix:
+                return
+
+    def list_files(self, prefix: str = "", start_after: Optional[str] = None, limit: Optional[int] = None):
+        return list(islice(self.iter_files(prefix, start_after), limit))
+
+
+def create_storage():
+    backend = os.getenv('STORAGE_BACKEND', 'minio')
+    if backend == 'minio':
+        return MinIOStorage()
+    if backend == 'filesystem':
+        return FilesystemStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
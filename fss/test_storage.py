@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+from storage import FilesystemStorage
+
+# "-" and "." sort before "/", so files named like these must come before the
+# contents of the directory they share a stem with.
+NAMES = [
+    "a-", "a.", "a0", "ab", "ba",
+    "a/b-c", "a/b.c", "a/b0", "a/b/e", "a/bc/d",
+    "b/c",
+]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = FilesystemStorage(str(tmp_path))
+    for name in NAMES:
+        storage.put_file(name, name.encode('utf-8'))
+    # An interrupted write leaves a file behind in staging; it must not be listed.
+    (storage.staging / "leftover").write_bytes(b"partial")
+    return storage
+
+
+def expected(prefix, start_after):
+    return sorted(
+        name for name in NAMES
+        if name.startswith(prefix) and (not start_after or name > start_after)
+    )
+
+
+def boundaries():
+    points = {""}
+    for name in NAMES:
+        points.update(name[:i] for i in range(len(name) + 1))
+    points.update(["a/b/", "a/b/z", "a/", "a/z", "z", ".staging"])
+    return sorted(points)
+
+
+def test_iter_files_matches_a_sorted_filter(storage):
+    points = boundaries()
+    for prefix, start_after in itertools.product(points, [None] + points):
+        assert list(storage.iter_files(prefix, start_after)) == expected(prefix, start_after), \
+            (prefix, start_after)
+
+
+def test_list_files_pages_cover_every_name_once(storage):
+    for limit in (1, 2, 3):
+        names, start_after = [], None
+        while True:
+            page = storage.list_files("a", start_after, limit)
+            names.extend(page)
+            if len(page) < limit:
+                break
+            start_after = page[-1]
+        assert names == expected("a", None)
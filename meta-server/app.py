@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+import json
 import math
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import os
 from models import (
     CDNRegisterRequest, CDNRegisterResponse,
@@ -9,12 +10,15 @@ from models import (
     DeleteFileRequest
 )
 from database import Database
+from metrics import install_metrics
 
 app = FastAPI()
+install_metrics(app)
 db = Database()
 
 FSS_LAT = 34.05
 FSS_LNG = -118.44
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
 
 def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
     R = 6371.0
@@ -76,6 +80,8 @@ def update_file_metadata(request: FileUpdateRequest):
 
 @app.post("/meta/query", response_model=FileQueryResponse)
 def query_file_location(request: FileQueryRequest):
+    file = db.get_file(request.file_name)
+    file_hash = file['hash'] if file else ""
     cdns_with_file = db.get_cdns_with_file(request.file_name)
     
     if cdns_with_file:
@@ -83,9 +89,9 @@ def query_file_location(request: FileQueryRequest):
         if closest_cdn != -1:
             if is_cdn_closer_than_fss(closest_cdn, request.client_lat, request.client_lng):
                 cdn = db.get_cdn_by_id(closest_cdn)
-                return FileQueryResponse(cdn_id=closest_cdn, cdn_address=cdn['address'])
+                return FileQueryResponse(cdn_id=closest_cdn, cdn_address=cdn['address'], file_hash=file_hash)
     
-    return FileQueryResponse(cdn_id=-1, cdn_address=f"localhost:5050")
+    return FileQueryResponse(cdn_id=-1, cdn_address=f"localhost:5050", file_hash=file_hash)
 
 
 @app.delete("/meta/delete")
@@ -98,12 +104,28 @@ def get_all_cdns():
     return {"cdns": db.get_all_cdns()}
 
 @app.get("/meta/files")
-def get_all_files():
-    cursor = db.get_cursor()
-    cursor.execute("SELECT * FROM files")
-    files = cursor.fetchall()
-    cursor.close()
-    return {"files": files}
+def get_all_files(
+    prefix: str = "",
+    after: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    files = db.list_files(prefix, after, limit)
+    next_after = files[-1]['name'] if len(files) == limit else None
+    return {"files": files, "next_after": next_after}
+
+@app.get("/meta/files/stream")
+def stream_files(prefix: str = "", after: Optional[str] = None):
+    def lines():
+        # Ends with {"end": true} or {"error": ...} so a cut-off stream is detectable.
+        try:
+            for file in db.iter_files(prefix, after, MAX_PAGE_SIZE):
+                yield json.dumps(file, default=str) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        yield json.dumps({"end": True}) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     import uvicorn
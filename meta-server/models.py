@@ -33,6 +33,7 @@ class FileQueryRequest(BaseModel):
 class FileQueryResponse(BaseModel):
     cdn_id: int
     cdn_address: str
+    file_hash: str = ""
 
 class DeleteFileRequest(BaseModel):
     file_name: str
@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmark'))
+
+from database import Database
+from standins import sqlite_database_class
+
+# LIKE wildcards and the escape character must match only themselves.
+NAMES = [
+    "a", "a%", "a%b", "a_", "a_b", "aXb", "ab", "a\\", "a\\b", "a\\_b",
+    "A_b", "_b", "%b", "b", "é",
+]
+
+
+@pytest.fixture
+def db():
+    db = sqlite_database_class(Database)()
+    for name in NAMES:
+        db.add_or_update_file(name, '', 0)
+    return db
+
+
+def expected(prefix, after=None):
+    return sorted(
+        name for name in NAMES
+        if name.startswith(prefix) and (after is None or name > after)
+    )
+
+
+@pytest.mark.parametrize("prefix", ["", "a", "a_", "a%", "a\\", "a\\_", "_", "%", "A", "é", "z"])
+def test_list_files_matches_prefix_literally(db, prefix):
+    assert [row['name'] for row in db.list_files(prefix)] == expected(prefix)
+
+
+@pytest.mark.parametrize("prefix", ["", "a", "a_", "a\\"])
+@pytest.mark.parametrize("page_size", [1, 2, 3])
+def test_keyset_pages_cover_every_name_once(db, prefix, page_size):
+    names, after = [], None
+    while True:
+        page = [row['name'] for row in db.list_files(prefix, after, page_size)]
+        assert page == expected(prefix, after)[:page_size]
+        names.extend(page)
+        if len(page) < page_size:
+            break
+        after = page[-1]
+    assert names == expected(prefix)
+    assert [row['name'] for row in db.iter_files(prefix, page_size=page_size)] == expected(prefix)
@@ -0,0 +1,143 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge
+
+
+class Overloaded(Exception):
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(f"{upstream} is overloaded")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class AdmissionMetrics:
+    """Limiter metrics for one service, labelled by upstream.
+
+    These are native metrics rather than a scrape-time collector so that in
+    multiprocess mode every worker's limiter adds up in one scrape.
+    """
+
+    def __init__(self, registry: CollectorRegistry):
+        self.in_flight = Gauge(
+            "admission_in_flight", "Calls currently running against the upstream", ["upstream"],
+            registry=registry, multiprocess_mode="livesum"
+        )
+        self.queued = Gauge(
+            "admission_queue_depth", "Calls waiting for an upstream slot", ["upstream"],
+            registry=registry, multiprocess_mode="livesum"
+        )
+        self.admitted = Counter(
+            "admission_admitted", "Calls admitted to the upstream", ["upstream"], registry=registry
+        )
+        self.shed = Counter(
+            "admission_shed", "Calls rejected because the queue was full", ["upstream"], registry=registry
+        )
+        self.timeouts = Counter(
+            "admission_timeouts", "Calls rejected after waiting past the queue deadline", ["upstream"],
+            registry=registry
+        )
+
+    def for_upstream(self, upstream: str) -> SimpleNamespace:
+        return SimpleNamespace(
+            in_flight=self.in_flight.labels(upstream),
+            queued=self.queued.labels(upstream),
+            admitted=self.admitted.labels(upstream),
+            shed=self.shed.labels(upstream),
+            timeouts=self.timeouts.labels(upstream),
+        )
+
+
+class AdmissionLimiter:
+    """Caps concurrent calls to one upstream and sheds load once its queue is full.
+
+    Up to ``max_concurrency`` callers run at once.  Up to ``max_queue`` more
+    wait, each for at most ``queue_timeout`` seconds.  Anything beyond that is
+    rejected immediately with ``Overloaded`` so the caller can answer 503.
+    """
+
+    def __init__(
+        self,
+        upstream: str,
+        max_concurrency: int = 32,
+        max_queue: int = 128,
+        queue_timeout: float = 2.0,
+        retry_after: int = 1,
+        metrics: Optional[AdmissionMetrics] = None,
+    ):
+        self.upstream = upstream
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timeouts = 0
+        self.metrics = metrics.for_upstream(upstream) if metrics is not None else None
+
+    def _count(self, event: str, amount: int = 1):
+        if self.metrics is not None:
+            getattr(self.metrics, event).inc(amount)
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self.semaphore.locked():
+            # A free permit is taken without suspending, so it cannot be raced.
+            await self.semaphore.acquire()
+        elif self.queued >= self.max_queue:
+            self.shed += 1
+            self._count("shed")
+            raise Overloaded(self.upstream, self.retry_after)
+        else:
+            self.queued += 1
+            self._count("queued")
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._count("timeouts")
+                raise Overloaded(self.upstream, self.retry_after)
+            finally:
+                self.queued -= 1
+                self._count("queued", -1)
+
+        self.admitted += 1
+        self.in_flight += 1
+        self._count("admitted")
+        self._count("in_flight")
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._count("in_flight", -1)
+            self.semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timeouts": self.timeouts
+        }
+
+
+def limiter_from_env(
+    upstream: str, env_prefix: str, metrics: Optional[AdmissionMetrics] = None
+) -> AdmissionLimiter:
+    return AdmissionLimiter(
+        upstream,
+        max_concurrency=int(os.getenv(f'{env_prefix}_MAX_CONCURRENCY', 32)),
+        max_queue=int(os.getenv(f'{env_prefix}_MAX_QUEUE', 128)),
+        queue_timeout=float(os.getenv(f'{env_prefix}_QUEUE_TIMEOUT', 2.0)),
+        retry_after=int(os.getenv('ADMISSION_RETRY_AFTER', 1)),
+        metrics=metrics,
+    )
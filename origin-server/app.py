@@ -1,39 +1,84 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 import httpx
+import asyncio
 import os
+from typing import Optional
 from models import ClientRequest, SyncResponse, ExplicitResponse
+from admission import AdmissionMetrics, Overloaded, limiter_from_env
+from metrics import install_metrics, registry, upstream_timer
 
 app = FastAPI()
+install_metrics(app)
 
 META_SERVER_URL = os.getenv('META_SERVER_URL', 'http://meta-server:8002')
 
+meta_limiter = limiter_from_env('meta', 'META', AdmissionMetrics(registry))
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/origin/stats")
+def get_stats():
+    return {"admission": {"meta": meta_limiter.snapshot()}}
+
+async def query_location(client: httpx.AsyncClient, file_name: str, lat: float, lng: float) -> Optional[dict]:
+    query_payload = {
+        "file_name": file_name,
+        "client_lat": lat,
+        "client_lng": lng
+    }
+    
+    async with meta_limiter.slot():
+        with upstream_timer('meta', 'query'):
+            response = await client.post(f"{META_SERVER_URL}/meta/query", json=query_payload)
+    
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    return {
+        "file_name": file_name,
+        "cdn_address": data["cdn_address"],
+        "cdn_id": data["cdn_id"],
+        "file_hash": data.get("file_hash", "")
+    }
+
 @app.post("/origin/sync")
 async def handle_sync(request: ClientRequest):
-    results = []
+    # Queries run concurrently, but no more than the limiter admits at once, so
+    # one large sync cannot fill the admission queue and shed its own queries.
+    fanout = asyncio.Semaphore(meta_limiter.max_concurrency)
+    # A query the meta server sheds fails only its own file, which is handed
+    # back for the client to retry rather than failing the whole sync.
+    retry = []
+    
+    async def locate(client: httpx.AsyncClient, file_name: str) -> Optional[dict]:
+        async with fanout:
+            try:
+                return await query_location(client, file_name, request.Lat, request.Lng)
+            except Overloaded:
+                retry.append(file_name)
+                return None
     
     async with httpx.AsyncClient() as client:
-        for file_info in request.FileList:
-            query_payload = {
-                "file_name": file_info.Name,
-                "client_lat": request.Lat,
-                "client_lng": request.Lng
-            }
-            
-            response = await client.post(f"{META_SERVER_URL}/meta/query", json=query_payload)
-            
-            if response.status_code == 200:
-                data = response.json()
-                results.append({
-                    "file_name": file_info.Name,
-                    "cdn_address": data["cdn_address"],
-                    "cdn_id": data["cdn_id"]
-                })
+        located = await asyncio.gather(*(locate(client, file_info.Name) for file_info in request.FileList))
     
-    return {"files": results}
+    files = [result for result in located if result is not None]
+    if not retry:
+        return {"files": files, "retry": []}
+    return JSONResponse(
+        content={"files": files, "retry": retry},
+        headers={"Retry-After": str(meta_limiter.retry_after)}
+    )
 
 @app.post("/origin/explicit")
 async def handle_explicit(request: ClientRequest):
@@ -49,14 +94,17 @@ async def handle_explicit(request: ClientRequest):
             "client_lng": request.Lng
         }
         
-        response = await client.post(f"{META_SERVER_URL}/meta/query", json=query_payload)
+        async with meta_limiter.slot():
+            with upstream_timer('meta', 'query'):
+                response = await client.post(f"{META_SERVER_URL}/meta/query", json=query_payload)
         
         if response.status_code == 200:
             data = response.json()
             return {
                 "cdn_address": data["cdn_address"],
                 "file_name": file_info.Name,
-                "cdn_id": data["cdn_id"]
+                "cdn_id": data["cdn_id"],
+                "file_hash": data.get("file_hash", "")
             }
 
         else:
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+import os
+import time
+from fastapi import FastAPI, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, GCCollector, Histogram,
+    PlatformCollector, ProcessCollector, generate_latest, multiprocess
+)
+from starlette.datastructures import MutableHeaders
+
+# Each service keeps its own registry so several services can share one
+# interpreter without colliding metric names.
+registry = CollectorRegistry()
+
+# With PROMETHEUS_MULTIPROC_DIR set, counters, gauges and histograms of every
+# worker are written to files there and /metrics sums them, so whichever worker
+# answers a scrape reports the totals for the whole service.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Collectors that read process state at scrape time.  In multiprocess mode
+# they describe the worker answering the scrape.
+_scrape_time_collectors = []
+
+if not MULTIPROC_DIR:
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    GCCollector(registry=registry)
+
+def register_collector(collector):
+    registry.register(collector)
+    _scrape_time_collectors.append(collector)
+
+def scrape_registry() -> CollectorRegistry:
+    if not MULTIPROC_DIR:
+        return registry
+    aggregated = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregated, path=MULTIPROC_DIR)
+    for collector in _scrape_time_collectors:
+        aggregated.register(collector)
+    return aggregated
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ["method", "route", "status"],
+    registry=registry
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to other services and backing stores",
+    ["upstream", "operation"],
+    registry=registry
+)
+
+# Phases timed during the current request, reported in the Server-Timing header.
+_server_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar(
+    "server_timings", default=None
+)
+
+@contextmanager
+def timed(name: str, histogram: Optional[Histogram] = None, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is not None:
+            histogram.labels(**labels).observe(elapsed)
+        timings = _server_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+def upstream_timer(upstream: str, operation: str):
+    return timed(upstream, UPSTREAM_LATENCY, upstream=upstream, operation=operation)
+
+def format_server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    totals["total"] = total
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in totals.items())
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = []
+        status = 500
+        token = _server_timings.set(timings)
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    format_server_timing(timings, time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _server_timings.reset(token)
+            # The router stores the matched route in the shared scope, which
+            # keeps label cardinality bounded by the number of routes.
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=str(status)
+            ).observe(time.perf_counter() - start)
+
+def install_metrics(app: FastAPI):
+    app.add_middleware(MetricsMiddleware)
+
+    @app.on_event("shutdown")
+    def drop_live_gauges():
+        # "livesum" gauges (in-flight, queue depth, pool use) would otherwise keep
+        # this worker's last values in the sum after it exits.
+        if MULTIPROC_DIR:
+            multiprocess.mark_process_dead(os.getpid(), MULTIPROC_DIR)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(generate_latest(scrape_registry()), media_type=CONTENT_TYPE_LATEST)
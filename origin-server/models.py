@@ -23,3 +23,4 @@ class SyncResponse(BaseModel):
 class ExplicitResponse(BaseModel):
     cdn_address: str
     file_name: str
+    file_hash: str = ""